@@ -1,102 +1,515 @@
 """
 Audio Flamingo 3 - Modal Serverless Deployment
-Music Understanding AI - Persistent Model Caching
+Music Understanding AI - Weights Baked Into the Image
 """
 
+import functools
+import gc
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
 import modal
 
+MODEL_ID = "nvidia/audio-flamingo-3-hf"
+
+# int8 weights baked into the image at build time (see build_weights)
+QUANTIZED_DIR = "/model-int8"
+
+
+def build_weights():
+    """Image build step: quantize the LLM tower to int8 and bake only that copy"""
+    import shutil
+    import tempfile
+    from huggingface_hub import snapshot_download
+    from transformers import (
+        AudioFlamingo3ForConditionalGeneration,
+        AutoProcessor,
+        BitsAndBytesConfig,
+    )
+    import torch
+    
+    # The fp16 shards are fetched and deleted within this one step, so no layer keeps them
+    fp16_dir = tempfile.mkdtemp()
+    try:
+        snapshot_download(MODEL_ID, local_dir=fp16_dir)
+        
+        print(f"🔧 Quantizing {MODEL_ID} to int8...")
+        quantization_config = BitsAndBytesConfig(
+            load_in_8bit=True,
+            # Audio encoder and projector stay in bf16
+            llm_int8_skip_modules=["audio_tower", "multi_modal_projector", "lm_head"],
+        )
+        model = AudioFlamingo3ForConditionalGeneration.from_pretrained(
+            fp16_dir,
+            local_files_only=True,
+            device_map="cuda",
+            torch_dtype=torch.bfloat16,
+            quantization_config=quantization_config,
+        )
+        model.save_pretrained(QUANTIZED_DIR)
+        AutoProcessor.from_pretrained(fp16_dir, local_files_only=True).save_pretrained(QUANTIZED_DIR)
+        print(f"✅ Saved quantized model to {QUANTIZED_DIR}")
+    finally:
+        shutil.rmtree(fp16_dir, ignore_errors=True)
+
+
 # Modal image with all dependencies
 image = (
     modal.Image.debian_slim(python_version="3.10")
     .pip_install(
-        "torch>=2.0.0",
+        # Pinned as a pair with the flash-attn wheel below
+        "torch==2.5.1",
+        "torchaudio==2.5.1",
         "transformers>=4.48.0",
         "accelerate>=0.25.0",
-        "huggingface-hub>=0.19.0",
+        "bitsandbytes>=0.43.0",
+        "huggingface-hub>=0.23.0",  # local_dir downloads bypass the global cache
+        "hf_transfer>=0.1",
         "soundfile>=0.12.1",
-        "librosa>=0.10.1",
         "numpy>=1.24.0",
         "fastapi>=0.104.0",
         "python-multipart>=0.0.6",
+        "blake3>=0.4.0",
+        # Prebuilt for torch 2.5 / CUDA 12 / cp310: debian_slim has no nvcc to build from source
+        "flash-attn @ https://github.com/Dao-AILab/flash-attention/releases/download/v2.7.4.post1/"
+        "flash_attn-2.7.4.post1+cu12torch2.5cxx11abiFALSE-cp310-cp310-linux_x86_64.whl",
     )
-    .env({
-        "HF_HUB_ENABLE_HF_TRANSFER": "1",
-        "HF_HOME": "/cache/hf",  # Store HF cache on volume
-        "TRANSFORMERS_CACHE": "/cache/transformers",
-    })
+    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+    # Content-addressed image layers mount faster than a volume on cold start
+    .run_function(build_weights, gpu="L4")
 )
 
 # Modal app
 app = modal.App("audio-flamingo-music", image=image)
 
-# Volume for caching models (persisted across runs)
-cache_vol = modal.Volume.from_name("audio-flamingo-cache", create_if_missing=True)
+# Results keyed by command + audio content hash, so re-requests never reach the GPU
+results_cache = modal.Dict.from_name("musicmind-results", create_if_missing=True)
+
+# Key prefix for results_cache; bump when weights, prompts or generation settings change
+RESULTS_CACHE_VERSION = f"{MODEL_ID}:int8:v1"
+
+# Free GPU memory after this many idle seconds; reloaded on the next call
+IDLE_UNLOAD_SECONDS = float(os.getenv("MUSICMIND_IDLE_UNLOAD", "120"))
+IDLE_CHECK_INTERVAL = 30
+
+# Rendered chat templates kept per distinct prompt text
+PROMPT_CACHE_SIZE = 256
+
+# Concurrent requests coalesced into one model.generate call
+MAX_BATCH_SIZE = 8
+BATCH_WAIT_MS = 75
+
+
+def _batch_key(gen_kwargs: dict) -> tuple:
+    """Hashable key so only requests with identical generation settings share a batch"""
+    return tuple(sorted(
+        (k, v if isinstance(v, (int, float, str, bool, type(None))) else id(v))
+        for k, v in gen_kwargs.items()
+    ))
+
+
+class _GenerateBatcher:
+    """Coalesce concurrent generate calls into padded batches on a single worker thread"""
+    
+    def __init__(self, run_batch, max_batch_size: int = MAX_BATCH_SIZE, wait_ms: int = BATCH_WAIT_MS):
+        self._run_batch = run_batch
+        self._max_batch_size = max_batch_size
+        self._wait = wait_ms / 1000
+        self._queue = queue.Queue()
+        self._deferred = []  # pulled while batching a different generation config
+        threading.Thread(target=self._loop, daemon=True).start()
+    
+    def submit(self, prompt: str, audio, gen_kwargs: dict) -> Future:
+        future = Future()
+        self._queue.put((_batch_key(gen_kwargs), (prompt, audio), gen_kwargs, future))
+        return future
+    
+    def _loop(self):
+        while True:
+            first = self._deferred.pop(0) if self._deferred else self._queue.get()
+            key = first[0]
+            batch = [first]
+            
+            deferred, self._deferred = self._deferred, []
+            for request in deferred:
+                if request[0] == key and len(batch) < self._max_batch_size:
+                    batch.append(request)
+                else:
+                    self._deferred.append(request)
+            
+            deadline = time.monotonic() + self._wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request[0] == key:
+                    batch.append(request)
+                else:
+                    self._deferred.append(request)
+            
+            try:
+                responses = self._run_batch([r[1] for r in batch], first[2])
+            except Exception as e:
+                for request in batch:
+                    request[3].set_exception(e)
+            else:
+                for request, response in zip(batch, responses):
+                    request[3].set_result(response)
+
+
+def _attn_implementation() -> str:
+    """FlashAttention-2 when the kernels are installed, PyTorch SDPA otherwise"""
+    import importlib.util
+    
+    return "flash_attention_2" if importlib.util.find_spec("flash_attn") else "sdpa"
+
+
+class _PinnedBufferPool:
+    """Reusable page-locked host buffers for H2D copies, bucketed by power-of-two length"""
+    
+    def __init__(self, preallocate: int = 30 * 48000):
+        self._lock = threading.Lock()
+        self._free: dict[int, list] = {}
+        bucket = self._bucket(preallocate)
+        self._free[bucket] = [(self._alloc(bucket), None)]
+    
+    @staticmethod
+    def _bucket(n: int) -> int:
+        return 1 << max(n - 1, 0).bit_length()
+    
+    @staticmethod
+    def _alloc(n: int):
+        import torch
+        
+        return torch.empty(n, dtype=torch.float32, pin_memory=True)
+    
+    def to_device(self, tensor, device):
+        """Stage a float32 tensor through a pinned buffer and copy it asynchronously"""
+        import torch
+        
+        n = tensor.numel()
+        bucket = self._bucket(n)
+        with self._lock:
+            free = self._free.get(bucket)
+            buf, pending = free.pop() if free else (None, None)
+        if buf is None:
+            buf = self._alloc(bucket)
+        elif pending is not None:
+            # The previous copy out of this buffer must finish before it is overwritten
+            pending.synchronize()
+        
+        buf[:n].copy_(tensor.reshape(-1))
+        out = buf[:n].to(device, non_blocking=True)
+        done = torch.cuda.Event()
+        done.record()
+        
+        with self._lock:
+            self._free.setdefault(bucket, []).append((buf, done))
+        return out.view(tensor.shape)
 
 
 @app.cls(
-    gpu="A100",
+    gpu="L4",
     container_idle_timeout=300,
-    timeout=1800,  # 30 min timeout for initial model download
-    volumes={"/cache": cache_vol},
+    timeout=1800,
+    allow_concurrent_inputs=MAX_BATCH_SIZE,
 )
 class AudioFlamingoMusic:
     """Audio Flamingo 3 for music understanding"""
     
     @modal.enter()
     def load_model(self):
-        """Load model - downloads once, cached forever"""
+        """Load model and start the idle-unload watchdog"""
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_used = time.monotonic()
+        self._prompt_cache: dict[str, str] = {}
+        self._batcher = _GenerateBatcher(self._generate_batch)
+        # Tempo estimation overlaps with generate on this pool
+        self._pool = ThreadPoolExecutor(max_workers=MAX_BATCH_SIZE)
+        self._pinned = _PinnedBufferPool()
+        self._load_weights()
+        self._schedule_idle_check()
+    
+    def _load_weights(self):
+        """Load model from the weights baked into the image"""
         from transformers import (
             AudioFlamingo3ForConditionalGeneration,
             AutoProcessor,
         )
         import torch
-        import os
+        import torchaudio
         
-        model_id = "nvidia/audio-flamingo-3-hf"
+        print(f"🎵 Loading Audio Flamingo 3 (int8) from {QUANTIZED_DIR}...")
         
-        print("🎵 Loading Audio Flamingo 3...")
-        print(f"📦 Cache location: /cache")
+        # Everything is loaded into locals first: a failed reload must not leave
+        # hasattr(self, "model") true with the processor or mel missing
+        processor = AutoProcessor.from_pretrained(QUANTIZED_DIR, local_files_only=True)
         
-        # Check if already cached
-        cache_size = self._get_dir_size("/cache")
-        print(f"💾 Current cache size: {cache_size / 1e9:.2f} GB")
+        def load(attn_implementation):
+            return AudioFlamingo3ForConditionalGeneration.from_pretrained(
+                QUANTIZED_DIR,
+                local_files_only=True,
+                device_map="cuda",
+                torch_dtype=torch.bfloat16,
+                attn_implementation=attn_implementation,
+            )
         
-        self.processor = AutoProcessor.from_pretrained(
-            model_id,
-            cache_dir="/cache/transformers",
-            local_files_only=False,
-        )
+        attn = _attn_implementation()
+        model = None
+        try:
+            model = load(attn)
+        except (ImportError, ValueError) as e:
+            # FA2 kernels that fail to import or aren't supported by the model class
+            if attn == "sdpa":
+                raise
+            print(f"⚠️ {attn} rejected ({e}), falling back to sdpa")
+        if model is None:
+            # Retried outside the except block so the traceback can't pin a partial load
+            gc.collect()
+            torch.cuda.empty_cache()
+            model = load("sdpa")
+        
+        print(f"⚡ Attention: {model.config._attn_implementation}")
+        model.generation_config.use_cache = True
+        
+        # Decoder-only generation needs prompts padded on the left when batched
+        processor.tokenizer.padding_side = "left"
         
-        self.model = AudioFlamingo3ForConditionalGeneration.from_pretrained(
-            model_id,
-            cache_dir="/cache/transformers",
-            device_map="auto",
-            torch_dtype=torch.float16,
-            local_files_only=False,
+        gen_cfgs = self._build_generation_configs(model, processor)
+        
+        # GPU front end for tempo estimation, set up like librosa's onset_strength
+        # (torchaudio otherwise defaults to HTK mels, no norm and reflect padding)
+        mel = torchaudio.transforms.MelSpectrogram(
+            sample_rate=22050,
+            n_fft=2048,
+            hop_length=512,
+            n_mels=128,
+            mel_scale="slaney",
+            norm="slaney",
+            pad_mode="constant",
+        ).to(model.device)
+        
+        self.processor = processor
+        self.gen_cfg_creative, self.gen_cfg_analysis, self.gen_cfg_greedy = gen_cfgs
+        self.mel = mel
+        # Assigned last: its presence is what marks the weights as loaded
+        self.model = model
+        
+        print("✅ Model loaded!")
+    
+    @staticmethod
+    def _build_generation_configs(model, processor) -> tuple:
+        """Per-command generation settings (creative, analysis, greedy) derived from the model's defaults"""
+        import copy
+        
+        def derive(**overrides):
+            config = copy.deepcopy(model.generation_config)
+            config.update(
+                num_beams=1,
+                use_cache=True,
+                pad_token_id=processor.tokenizer.pad_token_id,
+                **overrides,
+            )
+            return config
+        
+        # Captions and party verdicts are short; 256 tokens is plenty
+        return (
+            derive(do_sample=True, temperature=0.7, top_p=0.9, max_new_tokens=256),
+            derive(do_sample=True, temperature=0.7, top_p=0.9, max_new_tokens=512),
+            derive(do_sample=False, max_new_tokens=1024),
         )
+    
+    def _schedule_idle_check(self):
+        """Re-arm the watchdog timer"""
+        timer = threading.Timer(IDLE_CHECK_INTERVAL, self._unload_if_idle)
+        timer.daemon = True
+        timer.start()
+    
+    def _unload_if_idle(self):
+        """Drop the weights from VRAM once no call has arrived for IDLE_UNLOAD_SECONDS"""
+        import torch
+        
+        with self._lock:
+            idle = time.monotonic() - self._last_used
+            if self._active == 0 and idle > IDLE_UNLOAD_SECONDS and hasattr(self, "model"):
+                print(f"💤 Idle for {idle:.0f}s, unloading model")
+                del self.model
+                del self.processor
+                del self.mel
+                gc.collect()
+                torch.cuda.empty_cache()
+        self._schedule_idle_check()
+    
+    @contextmanager
+    def _in_use(self):
+        """Guard for method bodies: reload the model if it was unloaded while idle"""
+        try:
+            # Counted inside the try so a failed reload still releases its slot
+            with self._lock:
+                self._active += 1
+                self._last_used = time.monotonic()
+                if not hasattr(self, "model"):
+                    self._load_weights()
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_used = time.monotonic()
+    
+    def _render_prompt(self, prompt: str) -> str:
+        """Chat-template text for a prompt; the audio placeholder is expanded by the processor"""
+        text = self._prompt_cache.get(prompt)
+        if text is None:
+            conversation = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "audio"},
+                    ],
+                }
+            ]
+            text = self.processor.apply_chat_template(
+                conversation,
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+            if len(self._prompt_cache) >= PROMPT_CACHE_SIZE:
+                self._prompt_cache.pop(next(iter(self._prompt_cache)))
+            self._prompt_cache[prompt] = text
+        return text
+    
+    def _generate(self, prompt: str, audio, **gen_kwargs) -> str:
+        """Queue one prompt + audio for the next batched generate and wait for its response"""
+        return self._batcher.submit(prompt, audio, gen_kwargs).result()
+    
+    def _generate_batch(self, items: list, gen_kwargs: dict) -> list:
+        """Tokenize a batch of (prompt, audio) pairs with padding and run a single generate"""
+        inputs = self.processor(
+            text=[self._render_prompt(prompt) for prompt, _ in items],
+            audio=[audio for _, audio in items],
+            padding=True,
+            return_tensors="pt",
+        ).to(self.model.device)
+        
+        input_len = inputs.input_ids.shape[1]
+        outputs = self.model.generate(**inputs, use_cache=True, **gen_kwargs)
         
-        # Save to volume after download
-        cache_vol.commit()
+        # Plain id lists so the output tensor isn't held during string work
+        return [
+            self.processor.tokenizer.decode(row[input_len:].tolist(), skip_special_tokens=True)
+            for row in outputs
+        ]
+    
+    def _decode(self, audio_bytes: bytes):
+        """Decode once to a mono waveform shared by the processor and the tempo estimator"""
+        import io
+        import soundfile as sf
+        import torch
         
-        new_size = self._get_dir_size("/cache")
-        print(f"✅ Model loaded! Cache size: {new_size / 1e9:.2f} GB")
+        # libsndfile sniffs the container from the bytes (WAV, FLAC, OGG, MP3)
+        data, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+        return torch.from_numpy(data.mean(axis=1)), sr
     
-    def _get_dir_size(self, path):
-        """Get directory size in bytes"""
-        import os
-        total = 0
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.exists(fp):
-                    total += os.path.getsize(fp)
-        return total
+    def _audio_input(self, wav, sr: int):
+        """Resample to the feature extractor's rate for the processor's audio array input"""
+        import torchaudio
+        
+        target_sr = self.processor.feature_extractor.sampling_rate
+        return torchaudio.functional.resample(wav, sr, target_sr).numpy()
+    
+    def _estimate_tempo(self, wav, sr: int, hop_length: int = 512) -> float:
+        """Estimate global tempo (BPM) on the GPU; an approximation of librosa.beat.beat_track's estimate"""
+        import math
+        import torch
+        import torchaudio
+        
+        # First 30s, resampled on the GPU to librosa's default rate
+        wav = self._pinned.to_device(wav[: 30 * sr], self.model.device)
+        wav = torchaudio.functional.resample(wav, sr, 22050)
+        sr = 22050
+        if wav.shape[-1] < self.mel.n_fft:
+            # Too short for a single STFT frame
+            return 0.0
+        
+        # Onset strength: positive spectral flux of the log-power mel spectrogram
+        mel = self.mel(wav)
+        db = 10.0 * torch.log10(torch.clamp(mel, min=1e-10))
+        db = torch.maximum(db, db.max() - 80.0)
+        onset = torch.relu(db[:, 1:] - db[:, :-1]).mean(dim=0)
+        
+        n = onset.shape[-1]
+        if n < 2:
+            return 0.0
+        
+        # Autocorrelation tempogram via FFT, then argmax under a log-normal prior at 120 BPM
+        onset = onset - onset.mean()
+        spectrum = torch.fft.rfft(onset, n=2 * n)
+        ac = torch.fft.irfft(spectrum.abs() ** 2, n=2 * n)[:n]
+        if ac[0] <= 0:
+            return 0.0
+        ac = ac / ac[0]
+        
+        lags = torch.arange(1, n, device=onset.device, dtype=onset.dtype)
+        bpm = 60.0 * sr / (hop_length * lags)
+        score = torch.log1p(1e6 * torch.clamp(ac[1:], min=0.0))
+        score = score - 0.5 * (torch.log2(bpm) - math.log2(120.0)) ** 2
+        valid = (bpm >= 30.0) & (bpm <= 300.0)
+        if not bool(valid.any()):
+            # Clip too short to hold a single beat period in range
+            return 0.0
+        score = torch.where(valid, score, torch.full_like(score, -float("inf")))
+        
+        return float(bpm[torch.argmax(score)])
+    
+    def _analyze(self, audio_bytes: bytes, prompt: str, generation_config, include_bpm: bool = True) -> dict:
+        """Shared body of the analysis-style commands"""
+        with self._in_use():
+            wav, sr = self._decode(audio_bytes)
+            
+            # Start tempo estimation from the same decode so it runs while generate decodes
+            tempo_future = self._pool.submit(self._estimate_tempo, wav, sr) if include_bpm else None
+            
+            response = self._generate(
+                prompt,
+                self._audio_input(wav, sr),
+                generation_config=generation_config,
+            )
+            
+            result = {
+                "analysis": response,
+                "duration_seconds": wav.shape[-1] / sr,
+            }
+            if tempo_future is not None:
+                tempo = tempo_future.result()
+                result["tempo_bpm"] = float(tempo) if tempo else 0
+            return result
+    
+    def _transcribe(self, audio_bytes: bytes) -> dict:
+        """Body of transcribe_lyrics: greedy decode"""
+        with self._in_use():
+            wav, sr = self._decode(audio_bytes)
+            
+            response = self._generate(
+                "Transcribe all lyrics from this song accurately.",
+                self._audio_input(wav, sr),
+                generation_config=self.gen_cfg_greedy,
+            )
+            
+            return {"lyrics": response}
     
     @modal.method()
-    def analyze_music(self, audio_path: str, prompt: str = None) -> dict:
+    def analyze_music(self, audio_bytes: bytes, prompt: str = None, include_bpm: bool = True) -> dict:
         """Analyze music and provide insights"""
-        import librosa
-        
         if prompt is None:
             prompt = """Analyze this music and provide:
             1. Genre and style
@@ -106,182 +519,109 @@ class AudioFlamingoMusic:
             5. Production notes (tempo, key, instrumentation)
             """
         
-        conversation = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "audio", "path": audio_path},
-                ],
-            }
-        ]
-        
-        inputs = self.processor.apply_chat_template(
-            conversation,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-        ).to(self.model.device)
-        
-        outputs = self.model.generate(
-            **inputs,
-            max_new_tokens=512,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.9,
-        )
-        
-        response = self.processor.batch_decode(
-            outputs[:, inputs.input_ids.shape[1]:],
-            skip_special_tokens=True,
-        )[0]
-        
-        # Get audio features
-        try:
-            y, sr = librosa.load(audio_path, sr=None, duration=30)
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            duration = len(y) / sr
-        except:
-            tempo = 0
-            duration = 0
-        
-        return {
-            "analysis": response,
-            "tempo_bpm": float(tempo) if tempo else 0,
-            "duration_seconds": duration,
-        }
+        return self._analyze(audio_bytes, prompt, self.gen_cfg_analysis, include_bpm)
     
     @modal.method()
-    def party_vibe_check(self, audio_path: str) -> dict:
+    def party_vibe_check(self, audio_bytes: bytes) -> dict:
         """Check if track is good for a party"""
         prompt = """Rate this track for a party (1-10) and explain why.
         Consider: energy, danceability, crowd appeal, drop quality.
         Give a one-line verdict like "🔥 BANGER - Drop this at peak time!" or "😴 Skip - Too chill"
         """
         
-        result = self.analyze_music(audio_path, prompt)
+        result = self._analyze(audio_bytes, prompt, self.gen_cfg_creative)
         result["vibe_check"] = True
         return result
     
     @modal.method()
-    def transcribe_lyrics(self, audio_path: str) -> dict:
+    def transcribe_lyrics(self, audio_bytes: bytes) -> dict:
         """Transcribe lyrics from music"""
-        conversation = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Transcribe all lyrics from this song accurately."},
-                    {"type": "audio", "path": audio_path},
-                ],
-            }
-        ]
-        
-        inputs = self.processor.apply_chat_template(
-            conversation,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-        ).to(self.model.device)
-        
-        outputs = self.model.generate(
-            **inputs,
-            max_new_tokens=1024,
-        )
-        
-        response = self.processor.batch_decode(
-            outputs[:, inputs.input_ids.shape[1]:],
-            skip_special_tokens=True,
-        )[0]
-        
-        return {"lyrics": response}
+        return self._transcribe(audio_bytes)
     
     @modal.method()
-    def generate_caption(self, audio_path: str) -> dict:
+    def generate_caption(self, audio_bytes: bytes) -> dict:
         """Generate social media caption"""
         prompt = """Create a catchy social media caption for this track.
         Make it fun, include emojis, and capture the vibe.
         Examples: "This drop hits different 🚀", "Late night drives only 🌙"
         """
         
-        return self.analyze_music(audio_path, prompt)
+        return self._analyze(audio_bytes, prompt, self.gen_cfg_creative, include_bpm=False)
+
+
+# Upload routes served by the GPU class, besides /analyze which also takes a prompt
+UPLOAD_ROUTES = {
+    "party-vibe": "party_vibe_check",
+    "transcribe": "transcribe_lyrics",
+    "caption": "generate_caption",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _handler():
+    """GPU class handle, created on the first request and shared by every route"""
+    return AudioFlamingoMusic()
 
 
 # FastAPI web endpoint
-@app.function(volumes={"/cache": cache_vol})
+@app.function()
 @modal.asgi_app()
 def fastapi_app():
     """FastAPI app for HTTP requests"""
     from fastapi import FastAPI, File, UploadFile, Form
     from fastapi.responses import JSONResponse
-    import tempfile
-    import os
     
     web_app = FastAPI(title="Audio Flamingo Music API")
-    handler = AudioFlamingoMusic()
     
-    @web_app.post("/analyze")
-    async def analyze(file: UploadFile = File(...), prompt: str = Form(None)):
-        """Analyze uploaded audio file"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+    async def dispatch(method_name: str, file: UploadFile, *args) -> JSONResponse:
+        """Serve from results_cache, else forward the upload to the GPU class and store the result"""
+        import blake3
         
-        try:
-            result = handler.analyze_music.remote(tmp_path, prompt)
-            return JSONResponse(result)
-        except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=500)
-        finally:
-            os.unlink(tmp_path)
-    
-    @web_app.post("/party-vibe")
-    async def party_vibe(file: UploadFile = File(...)):
-        """Check party vibe of a track"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+        content = await file.read()
+        
+        # Checked here rather than on the GPU worker so a hit never starts an L4
+        key = f"{RESULTS_CACHE_VERSION}:{method_name}:{blake3.blake3(content).hexdigest()}"
+        for arg in args:
+            if arg is not None:
+                key += f":{blake3.blake3(str(arg).encode()).hexdigest()}"
         
+        # The cache is best-effort: a Dict error never fails a request
         try:
-            result = handler.party_vibe_check.remote(tmp_path)
-            return JSONResponse(result)
+            result = await results_cache.get.aio(key)
         except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=500)
-        finally:
-            os.unlink(tmp_path)
-    
-    @web_app.post("/transcribe")
-    async def transcribe(file: UploadFile = File(...)):
-        """Transcribe lyrics from audio"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+            print(f"⚠️ Results cache lookup failed ({e})")
+            result = None
+        if result is not None:
+            return JSONResponse(result)
         
         try:
-            result = handler.transcribe_lyrics.remote(tmp_path)
-            return JSONResponse(result)
+            result = await getattr(_handler(), method_name).remote.aio(content, *args)
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
-        finally:
-            os.unlink(tmp_path)
-    
-    @web_app.post("/caption")
-    async def caption(file: UploadFile = File(...)):
-        """Generate social media caption"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
         
         try:
-            result = handler.generate_caption.remote(tmp_path)
-            return JSONResponse(result)
+            await results_cache.put.aio(key, result)
         except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=500)
-        finally:
-            os.unlink(tmp_path)
+            print(f"⚠️ Results cache store failed ({e})")
+        return JSONResponse(result)
+    
+    @web_app.post("/analyze")
+    async def analyze(file: UploadFile = File(...), prompt: str = Form(None)):
+        """Analyze uploaded audio file"""
+        return await dispatch("analyze_music", file, prompt)
+    
+    def upload_endpoint(method_name: str):
+        async def endpoint(file: UploadFile = File(...)):
+            return await dispatch(method_name, file)
+        return endpoint
+    
+    for route, method_name in UPLOAD_ROUTES.items():
+        web_app.add_api_route(
+            f"/{route}",
+            upload_endpoint(method_name),
+            methods=["POST"],
+            name=method_name,
+        )
     
     @web_app.get("/health")
     async def health():
@@ -308,21 +648,24 @@ def main():
     audio_file = sys.argv[1]
     command = sys.argv[2] if len(sys.argv) > 2 else "analyze"
     
+    with open(audio_file, "rb") as f:
+        audio_bytes = f.read()
+    
     handler = AudioFlamingoMusic()
     
     if command == "analyze":
-        result = handler.analyze_music.remote(audio_file)
+        result = handler.analyze_music.remote(audio_bytes)
         print(f"🎵 Analysis:\n{result['analysis']}")
         print(f"\n📊 Tempo: {result['tempo_bpm']:.1f} BPM")
     
     elif command == "party-vibe":
-        result = handler.party_vibe_check.remote(audio_file)
+        result = handler.party_vibe_check.remote(audio_bytes)
         print(f"🎉 Party Vibe Check:\n{result['analysis']}")
     
     elif command == "transcribe":
-        result = handler.transcribe_lyrics.remote(audio_file)
+        result = handler.transcribe_lyrics.remote(audio_bytes)
         print(f"🎤 Lyrics:\n{result['lyrics']}")
     
     elif command == "caption":
-        result = handler.generate_caption.remote(audio_file)
+        result = handler.generate_caption.remote(audio_bytes)
         print(f"📱 Caption:\n{result['analysis']}")
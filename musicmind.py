@@ -7,7 +7,6 @@ Music understanding, party vibes, and audio intelligence
 import os
 import sys
 import json
-import requests
 import argparse
 from pathlib import Path
 from typing import Optional
@@ -26,7 +25,34 @@ class MusicMind:
     
     def __init__(self, endpoint: str = None):
         self.endpoint = endpoint or MODAL_ENDPOINT
-        self.session = requests.Session()
+        self._session = None
+    
+    @property
+    def session(self):
+        """HTTP client, created on first use so --help and usage errors skip importing httpx"""
+        if self._session is None:
+            import httpx
+            
+            # Keep-alive pool + HTTP/2 so repeated calls reuse one connection
+            self._session = httpx.Client(
+                http2=True,
+                timeout=120,
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=10),
+            )
+        return self._session
+    
+    def _upload(self, route: str, audio_path: str, data: Optional[dict] = None) -> dict:
+        """POST an audio file as multipart; httpx streams the file instead of reading it whole"""
+        with open(audio_path, 'rb') as f:
+            files = {'file': (Path(audio_path).name, f, 'audio/*')}
+            
+            response = self.session.post(
+                f"{self.endpoint}/{route}",
+                files=files,
+                data=data or {},
+            )
+            response.raise_for_status()
+            return response.json()
     
     def analyze(self, audio_path: str, prompt: Optional[str] = None) -> dict:
         """
@@ -39,18 +65,8 @@ class MusicMind:
         Returns:
             Analysis results with genre, mood, tempo, recommendations
         """
-        with open(audio_path, 'rb') as f:
-            files = {'file': f}
-            data = {'prompt': prompt} if prompt else {}
-            
-            response = self.session.post(
-                f"{self.endpoint}/analyze",
-                files=files,
-                data=data,
-                timeout=120,
-            )
-            response.raise_for_status()
-            return response.json()
+        data = {'prompt': prompt} if prompt else {}
+        return self._upload("analyze", audio_path, data)
     
     def party_vibe(self, audio_path: str) -> dict:
         """
@@ -59,42 +75,15 @@ class MusicMind:
         Returns party rating (1-10) and verdict like:
         "🔥 BANGER - Drop this at peak time!" or "😴 Skip - Too chill"
         """
-        with open(audio_path, 'rb') as f:
-            files = {'file': f}
-            
-            response = self.session.post(
-                f"{self.endpoint}/party-vibe",
-                files=files,
-                timeout=120,
-            )
-            response.raise_for_status()
-            return response.json()
+        return self._upload("party-vibe", audio_path)
     
     def transcribe(self, audio_path: str) -> dict:
         """Transcribe lyrics from a song"""
-        with open(audio_path, 'rb') as f:
-            files = {'file': f}
-            
-            response = self.session.post(
-                f"{self.endpoint}/transcribe",
-                files=files,
-                timeout=120,
-            )
-            response.raise_for_status()
-            return response.json()
+        return self._upload("transcribe", audio_path)
     
     def caption(self, audio_path: str) -> dict:
         """Generate social media caption for a track"""
-        with open(audio_path, 'rb') as f:
-            files = {'file': f}
-            
-            response = self.session.post(
-                f"{self.endpoint}/caption",
-                files=files,
-                timeout=120,
-            )
-            response.raise_for_status()
-            return response.json()
+        return self._upload("caption", audio_path)
     
     def health_check(self) -> dict:
         """Check if the service is healthy"""
@@ -173,6 +162,8 @@ Examples:
         print(f"❌ Error: File not found: {args.audio_file}")
         sys.exit(1)
     
+    import httpx
+    
     try:
         if args.command == 'analyze':
             result = mind.analyze(args.audio_file, args.prompt)
@@ -213,7 +204,7 @@ Examples:
                 print("=" * 50)
                 print(result['analysis'])
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"❌ API Error: {e}")
         sys.exit(1)
     except Exception as e: